@@ -8,8 +8,15 @@ folders, respectively
 
 @author: Tamas Nagy <tamas at tamasnagy dot com>
 """
-import os, sys, subprocess, warnings, re
+import os, sys, subprocess, warnings, re, time
 import pandas as pd, numpy as np
+from runstats import RunStats, NULL_STATS, cpu_time
+
+# IUPred (long) smooths the energy profile over the positions i-10 to i+11 and
+# the energy of each of those positions depends on the residues less than 100
+# positions away. So the score of a residue only depends on the residues at most
+# 110 positions away, and on where the sequence ends if it is closer than that.
+IUPRED_REACH = 110
 
 def process_cast(cast_output, seq):
     """
@@ -66,10 +73,11 @@ def process_cast(cast_output, seq):
     return region_info
 
 
-def IUPredRunner(seqs, seq_names, filename):
+def IUPredRunner(seqs, seq_names, filename, stats=NULL_STATS):
     """
     Runs IUPred on a list of sequences and saves the output
-    to the given filename.
+    to the given filename. Timings are recorded in `stats`, see
+    `runstats.RunStats`.
     """
     assert(len(seqs) == len(seq_names))
     if len(seqs) > 5000:
@@ -85,7 +93,189 @@ def IUPredRunner(seqs, seq_names, filename):
     results = []
     
     try:
-        os.chdir('iupred/')
+        results = getIUPredProfiles(seqs, seq_names, stats)
+        
+        # Glue all the columns together
+        with stats.stage('iupred.concat'):
+            probs = pd.concat(results, axis=1).T
+            probs.index = seq_names
+            
+    except subprocess.CalledProcessError as e:
+        print(e.output)
+    except KeyboardInterrupt:
+        print("Exiting...")
+    finally:
+        with stats.stage('iupred.write_csv'):
+            probs.to_csv(filename)
+
+def IUPredChainRunner(seqs, seq_names, filename, parent_seqs, parent_probs, verify=10, stats=NULL_STATS):
+    """
+    Runs IUPred on a list of sequences, reusing the predictions of their
+    parent proteins where possible, and saves the output to the given
+    filename. Meant for the "polyprots" dataset, where polyproteins are split
+    into their mature chains (named `ACCID~n`).
+
+    A sequence's parent is the protein with the same name or, for chains, the
+    name before the `~`. If the sequence is part of its parent's sequence, its
+    scores are copied from the parent's and only the residues within
+    `IUPRED_REACH` of a new chain boundary are recomputed, by running IUPred
+    on the first and/or last 2*`IUPRED_REACH` residues of the chain. Chains
+    no longer than their flanks and sequences without a usable parent are run
+    in full.
+
+    The output file is only written once all sequences ran and passed the
+    verification, so a failed run never leaves a cache behind that
+    `runDisorderedAnalysis` would pick up.
+
+    Parameters
+    ----------
+    parent_seqs : pandas.Series
+        Sequences of the parent proteins, indexed by name
+    parent_probs : pandas.DataFrame
+        IUPred output of the parent proteins as saved by `IUPredRunner`
+    verify : int, default 10
+        Number of derived sequences that are also run in full and compared to
+        the derived scores. A RuntimeError is raised on a mismatch.
+    """
+    assert(len(seqs) == len(seq_names))
+    reach = IUPRED_REACH
+    clean = lambda seq: re.sub(r'[^A-Za-z]', '', seq)
+
+    with stats.stage('iupred.derive'):
+        # Sequences (full runs and chain flanks) that need to go through IUPred
+        # and their names in the run statistics
+        jobs = []
+        job_names = []
+        # Per sequence: the reused profile (or None) and the jobs to splice in
+        # as (job index, slice of the job output, slice of the profile)
+        plans = []
+        for seq, name in zip(seqs, seq_names):
+            if pd.isnull(seq):
+                jobs.append(seq)
+                job_names.append(name)
+                plans.append((None, [(len(jobs)-1, slice(None), slice(None))]))
+                continue
+            seq = clean(seq)
+            length = len(seq)
+            parent = name if name in parent_probs.index else str(name).rsplit('~', 1)[0]
+            offset = -1
+            if parent in parent_probs.index and parent in parent_seqs.index and pd.notnull(parent_seqs[parent]):
+                parent_seq = clean(parent_seqs[parent])
+                parent_profile = parent_probs.loc[parent].values[:len(parent_seq)].astype(float)
+                if not np.isnan(parent_profile).any():
+                    offset = parent_seq.find(seq)
+            if offset < 0:
+                jobs.append(seq)
+                job_names.append(name)
+                plans.append((None, [(len(jobs)-1, slice(None), slice(None))]))
+                continue
+
+            profile = parent_profile[offset:offset+length].copy()
+            new_start = offset > 0
+            new_end = offset + length < len(parent_seq)
+            if length <= 2*reach*(new_start + new_end):
+                # Recomputing the flanks (2*reach residues for each new end)
+                # would cost as much as the whole chain
+                jobs.append(seq)
+                job_names.append(name)
+                plans.append((None, [(len(jobs)-1, slice(None), slice(None))]))
+                continue
+            splices = []
+            if new_start:
+                jobs.append(seq[:2*reach])
+                job_names.append('%s[start]'%name)
+                splices.append((len(jobs)-1, slice(0, reach), slice(0, reach)))
+            if new_end:
+                jobs.append(seq[length-2*reach:])
+                job_names.append('%s[end]'%name)
+                splices.append((len(jobs)-1, slice(reach, 2*reach), slice(length-reach, length)))
+            plans.append((profile, splices))
+
+        derived = [i for i, (profile, splices) in enumerate(plans) if profile is not None]
+        # Spread the verification over the derived sequences
+        checked = [derived[i] for i in np.unique(np.linspace(0, len(derived)-1, verify).astype(int))] \
+            if verify > 0 and len(derived) > 0 else []
+
+    print("Reusing parent predictions for %s of %s sequences. Running IUPRED on %s sequences "
+          "(%s full, %s verification)..."%(len(derived), len(seqs), len(jobs)+len(checked),
+                                           len(seqs)-len(derived), len(checked)))
+    sys.stdout.flush()
+
+    try:
+        outputs = getIUPredProfiles(jobs + [clean(seqs[i]) for i in checked],
+                                    job_names + ['%s[verify]'%seq_names[i] for i in checked], stats)
+        outputs = [output.values for output in outputs]
+
+        with stats.stage('iupred.derive'):
+            results = []
+            for profile, splices in plans:
+                if profile is None:
+                    results.append(pd.Series(outputs[splices[0][0]]))
+                    continue
+                for job, job_slice, profile_slice in splices:
+                    profile[profile_slice] = outputs[job][job_slice]
+                results.append(pd.Series(profile))
+
+            for i, full in zip(checked, outputs[len(jobs):]):
+                if len(full) != len(results[i]) or not np.allclose(full, results[i].values, atol=1e-4):
+                    raise RuntimeError("Scores derived from the parent of %s differ from a full IUPred run. "
+                                       "Check IUPRED_REACH."%seq_names[i])
+
+        # Glue all the columns together
+        with stats.stage('iupred.concat'):
+            probs = pd.concat(results, axis=1).T
+            probs.index = seq_names
+
+    except subprocess.CalledProcessError as e:
+        print(e.output)
+        raise
+    except KeyboardInterrupt:
+        print("Exiting...")
+        raise
+
+    with stats.stage('iupred.write_csv'):
+        probs.to_csv(filename)
+
+def getParentProfiles(seq_names, parent_file, filename, stats=NULL_STATS):
+    """
+    Returns the sequences and IUPred output of the parents (see
+    `IUPredChainRunner`) of the given sequences, which are looked up in
+    `parent_file`. If the full analysis of `parent_file` has been run, its
+    `*_iupred.csv` is used. Otherwise IUPred is run on the parents of the
+    polyprotein chains only, e.g. the precursor proteins that were split into
+    their chains, and the output is saved to (and later reused from)
+    `filename`.
+    """
+    with stats.stage('iupred.read_parents'):
+        parent_seqs = pd.read_csv(parent_file, index_col=0)['SEQ']
+        for output_file in ["%s_iupred.csv"%parent_file.rsplit('.csv', 1)[0], filename]:
+            if os.path.exists(output_file):
+                print('Found parent iupred output %s, using it.'%output_file)
+                return parent_seqs, pd.read_csv(output_file, index_col=0)
+
+    parents = sorted(set([str(name).rsplit('~', 1)[0] for name in seq_names if '~' in str(name)]))
+    parents = [parent for parent in parents if parent in parent_seqs.index and pd.notnull(parent_seqs[parent])]
+    print("Running IUPRED on %s parent proteins..."%len(parents))
+    sys.stdout.flush()
+
+    clean = lambda seq: re.sub(r'[^A-Za-z]', '', seq)
+    results = getIUPredProfiles([clean(parent_seqs[parent]) for parent in parents], parents, stats)
+    with stats.stage('iupred.concat'):
+        parent_probs = pd.concat(results, axis=1).T if len(results) > 0 else pd.DataFrame()
+        parent_probs.index = parents
+    # Only saved after a successful run, see IUPredChainRunner
+    with stats.stage('iupred.write_csv'):
+        parent_probs.to_csv(filename)
+    return parent_seqs, parent_probs
+
+def getIUPredProfiles(seqs, seq_names=None, stats=NULL_STATS):
+    """
+    Runs IUPred (long) on each of the given sequences and returns a list of
+    Pandas Series of the per-residue disorder scores. Must be called from the
+    project's root folder.
+    """
+    os.chdir('iupred/')
+    try:
         tmpfile = 'tmpfile.fasta'
         
         # Set the path to IUPred
@@ -96,24 +286,16 @@ def IUPredRunner(seqs, seq_names, filename):
         
         command = lambda: subprocess.check_output('./iupred %s "long"'%tmpfile, shell=True)
         
-        results = getRawOutput(seqs, tmpfile, command, f)
-        
-        # Glue all the columns together
-        probs = pd.concat(results, axis=1).T
-        probs.index = seq_names
-            
-    except subprocess.CalledProcessError as e:
-        print(e.output)
-    except KeyboardInterrupt:
-        print("Exiting...")
+        with stats.stage('iupred.run'):
+            return getRawOutput(seqs, tmpfile, command, f, stats, 'iupred', seq_names)
     finally:
         os.chdir('../')
-        probs.to_csv(filename)
         
-def CastRunner(seqs, seq_names, filename):
+def CastRunner(seqs, seq_names, filename, stats=NULL_STATS):
     """
     Runs CAST on the given list of sequences and saves the output to the
-    given filename.
+    given filename. Timings are recorded in `stats`, see
+    `runstats.RunStats`.
     """
     assert(len(seqs) == len(seq_names))
     if len(seqs) > 10000:
@@ -139,11 +321,13 @@ def CastRunner(seqs, seq_names, filename):
                              stderr=subprocess.PIPE).communicate()[0]
         
         # TODO: Test this on a Linux machine, hopefully this won't break.
-        results = getRawOutput(seqs, tmpfile, command, process_cast)
+        with stats.stage('cast.run'):
+            results = getRawOutput(seqs, tmpfile, command, process_cast, stats, 'cast', seq_names)
         
         # Glue all the columns together
-        probs = pd.concat(results, axis=1).T
-        probs.index = seq_names
+        with stats.stage('cast.concat'):
+            probs = pd.concat(results, axis=1).T
+            probs.index = seq_names
     
     except subprocess.CalledProcessError as e:
         print(e.output)
@@ -151,7 +335,8 @@ def CastRunner(seqs, seq_names, filename):
         print("Exiting...")
     finally:
         os.chdir('../')
-        probs.to_csv(filename)
+        with stats.stage('cast.write_csv'):
+            probs.to_csv(filename)
         
 def runGBA(seqs, seq_names, filename):
     """
@@ -170,16 +355,32 @@ def runGBA(seqs, seq_names, filename):
             f.write('>%s\n%s\n\n'%(name, seq))
 
 
-def runDisorderedAnalysis(input_file, runCAST=True, runIUPred=True, forceIUPred=False, forceCAST=False):
+def runDisorderedAnalysis(input_file, runCAST=True, runIUPred=True, forceIUPred=False, forceCAST=False,
+                          profile=False, parent_file=None):
     """
     Runs a suite of disorder prediction algorithms (e.g. IUPred, CAST) on the
     given input_file. This input_file should be a csv and have a column named
     `Sequences` and a column named `Entry`. The force options, if set to true,
     will re-run the analysis and override previous LCR and IDR information
     present in the csv, respectively.
+
+    If `profile` is set to true, the wall and CPU time of each stage and the
+    latency of every sequence are recorded, progress (sequences/s and ETA) is
+    printed while the predictors run and a report is written to
+    `*_runstats.json` next to the `*_iupred.csv`/`*_cast.csv` outputs.
+
+    If `parent_file` is given, e.g. the raw viral dataset when running the
+    "polyprots" dataset, the IUPred output of the proteins in it is reused for
+    all proteins and polyprotein chains they contain (see
+    `IUPredChainRunner`). If `parent_file` hasn't been analysed, IUPred is run
+    on the precursors of the chains only and their output is kept in
+    `*_parents_iupred.csv`, so later runs (e.g. with `forceIUPred`) only need
+    to recompute the chain ends.
     """
+    stats = RunStats(input_file) if profile else NULL_STATS
 
-    polyprots = pd.read_csv(input_file, index_col=0)
+    with stats.stage('read_csv'):
+        polyprots = pd.read_csv(input_file, index_col=0)
 
     if all(['LCRs' in polyprots.columns, 'IDRs' in polyprots.columns, not forceIUPred, not forceCAST]):
         print('Nothing to do. Use `force=True` to force generation.')
@@ -205,20 +406,23 @@ def runDisorderedAnalysis(input_file, runCAST=True, runIUPred=True, forceIUPred=
             print("No cast output found. Generating...\nHold tight this can take awhile if the dataset is big...")
             sys.stdout.flush()
             try:
-                CastRunner(polyprots['SEQ'].values.tolist(), polyprots.index.values.tolist(), cast_output_file)
-                cast_results = pd.read_csv(cast_output_file, index_col=0)
+                CastRunner(polyprots['SEQ'].values.tolist(), polyprots.index.values.tolist(), cast_output_file,
+                           stats)
+                with stats.stage('cast.read_csv'):
+                    cast_results = pd.read_csv(cast_output_file, index_col=0)
                 print('CAST run complete. Loading file and processing...')
                 sys.stdout.flush()
             except Exception as e:
                 raise
 
         # Clean up the results; compress into a single line; remove extraneous characters
-        tmp = cast_results.applymap(lambda x: str(x) if pd.notnull(x) else np.nan)
-        lcrs = (tmp + ':' + tmp.shift(-1, axis=1) + '_' + tmp.shift(-2, axis=1) + '$'+ tmp.shift(-3, axis=1)
-          + '@' + tmp.shift(-4, axis=1) + ';').iloc[:, ::5].fillna('').sum(1)
-        # Set blanks to null
-        lcrs[lcrs.str.len() == 0] = np.nan
-        polyprots.insert(polyprots.columns.get_loc('LENGTH')+1, 'LCRs', lcrs)
+        with stats.stage('cast.process'):
+            tmp = cast_results.applymap(lambda x: str(x) if pd.notnull(x) else np.nan)
+            lcrs = (tmp + ':' + tmp.shift(-1, axis=1) + '_' + tmp.shift(-2, axis=1) + '$'+ tmp.shift(-3, axis=1)
+              + '@' + tmp.shift(-4, axis=1) + ';').iloc[:, ::5].fillna('').sum(1)
+            # Set blanks to null
+            lcrs[lcrs.str.len() == 0] = np.nan
+            polyprots.insert(polyprots.columns.get_loc('LENGTH')+1, 'LCRs', lcrs)
 
     else:
         print('CAST output already in spreadsheet. Use forceCAST=True to force regeneration.')
@@ -243,10 +447,19 @@ def runDisorderedAnalysis(input_file, runCAST=True, runIUPred=True, forceIUPred=
             print('No iupred output found. Generating...\nHold tight this can take awhile if the dataset is big...')
             sys.stdout.flush()
             try:
-                IUPredRunner(polyprots['SEQ'].values.tolist(), polyprots.index.values.tolist(), iupred_output_file)
+                if parent_file is None:
+                    IUPredRunner(polyprots['SEQ'].values.tolist(), polyprots.index.values.tolist(),
+                                 iupred_output_file, stats)
+                else:
+                    parent_seqs, parent_probs = getParentProfiles(
+                        polyprots.index.values.tolist(), parent_file,
+                        "%s_parents_iupred.csv"%input_file.rsplit('.csv', 1)[0], stats)
+                    IUPredChainRunner(polyprots['SEQ'].values.tolist(), polyprots.index.values.tolist(),
+                                      iupred_output_file, parent_seqs, parent_probs, stats=stats)
                 print('IUPred run complete. Loading file and running thresholding...')
                 sys.stdout.flush()
-                iupred_results = pd.read_csv(iupred_output_file, index_col=0)
+                with stats.stage('iupred.read_csv'):
+                    iupred_results = pd.read_csv(iupred_output_file, index_col=0)
             except Exception as e:
                 raise
 
@@ -254,30 +467,38 @@ def runDisorderedAnalysis(input_file, runCAST=True, runIUPred=True, forceIUPred=
         thresholds = [1, 5, 10, 30, 50, 100]
         results = {k:[] for k in thresholds}
 
-        above_threshold = iupred_results >= 0.5
-        starts = ~above_threshold.shift(1, axis=1).fillna(False)
-        ends = ~above_threshold.shift(-1, axis=1).fillna(False)
+        with stats.stage('thresholding'):
+            above_threshold = iupred_results >= 0.5
+            starts = ~above_threshold.shift(1, axis=1).fillna(False)
+            ends = ~above_threshold.shift(-1, axis=1).fillna(False)
 
-        for i in xrange(len(iupred_results)):
-            # The first AA in a region is preceded by an AA not above the threshold
-            fst = iupred_results.columns[above_threshold.iloc[i, :] & starts.iloc[i, :]].astype(int)
-            # The last AA in a region is followed by an AA not above the threshold
-            lst = iupred_results.columns[above_threshold.iloc[i, :] & ends.iloc[i, :]].astype(int)
+            for i in xrange(len(iupred_results)):
+                # The first AA in a region is preceded by an AA not above the threshold
+                fst = iupred_results.columns[above_threshold.iloc[i, :] & starts.iloc[i, :]].astype(int)
+                # The last AA in a region is followed by an AA not above the threshold
+                lst = iupred_results.columns[above_threshold.iloc[i, :] & ends.iloc[i, :]].astype(int)
 
-            for threshold in thresholds:
-                # Save regions longer than the minimum length as given by the threshold
-                pr = [(i+1, j+1) for i, j in zip(fst, lst) if j >= i + threshold-1]
-                results[threshold].append(';'.join(['%s_%s'%reg for reg in pr]) if len(pr) > 0 else np.nan)
+                for threshold in thresholds:
+                    # Save regions longer than the minimum length as given by the threshold
+                    pr = [(i+1, j+1) for i, j in zip(fst, lst) if j >= i + threshold-1]
+                    results[threshold].append(';'.join(['%s_%s'%reg for reg in pr]) if len(pr) > 0 else np.nan)
 
-        disordered = pd.DataFrame(results, columns=thresholds, index=iupred_results.index)
-        disordered.columns=['IDR%d'%threshold for threshold in thresholds]
-        polyprots = polyprots.join(disordered)
+            disordered = pd.DataFrame(results, columns=thresholds, index=iupred_results.index)
+            disordered.columns=['IDR%d'%threshold for threshold in thresholds]
+            polyprots = polyprots.join(disordered)
 
     print('\nWriting results to file.')
-    polyprots.to_csv(input_file)
+    with stats.stage('write_csv'):
+        polyprots.to_csv(input_file)
+
+    if stats.enabled:
+        stats_file = "%s_runstats.json"%input_file.rsplit('.csv', 1)[0]
+        stats.write(stats_file)
+        print(stats.summary())
+        print('Run report written to %s'%stats_file)
 
 
-def getRawOutput(seqs, tmpfile, command, func):
+def getRawOutput(seqs, tmpfile, command, func, stats=NULL_STATS, label='run', seq_names=None):
     """
     Returns output from a given subprocess command that is run iteratively
     on a given sequence list. It writes to a temporary file on the disk that
@@ -285,9 +506,18 @@ def getRawOutput(seqs, tmpfile, command, func):
     takes the command line program's output + the original sequence and
     translates theme into a list of values. This is than cast into a Pandas
     Series so care should be taken when using this function.
+
+    If `stats` is enabled, the subprocess and parsing time of each sequence
+    are recorded under `label` (see `runstats.RunStats`), using `seq_names`
+    to identify the slowest sequences.
     """
     results = []
     raw = []
+    timed = stats.enabled
+    if timed:
+        stats.start_progress(label, len(seqs))
+        run_time = parse_time = run_cpu = parse_cpu = 0.0
+        num_run = 0
     
     # TODO: parallelize this. Sequentially is too slow for >10000 runs
     f = open(tmpfile, 'w')
@@ -302,12 +532,30 @@ def getRawOutput(seqs, tmpfile, command, func):
         # If we're missing the sequence data then just add a blank column
         if(pd.isnull(seq)):
             results.append(pd.Series([np.nan]))
+            stats.skip(label)
             continue
     
         # Run command on the temporary file; Process text
-        probs_list = func(command(), seq)
+        if timed:
+            t0, c0 = time.time(), cpu_time()
+            output = command()
+            t1, c1 = time.time(), cpu_time()
+            probs_list = func(output, seq)
+            t2, c2 = time.time(), cpu_time()
+            run_time += t1 - t0
+            parse_time += t2 - t1
+            run_cpu += c1 - c0
+            parse_cpu += c2 - c1
+            num_run += 1
+            stats.record(label, t2 - t0, seq_names[i] if seq_names is not None else i, len(seq))
+        else:
+            probs_list = func(command(), seq)
         results.append(pd.Series(probs_list if len(probs_list) > 0 else [np.nan]))
         
     f.close()
+    if timed:
+        stats.report_progress()
+        stats.add_time('%s.subprocess'%label, run_time, num_run, run_cpu)
+        stats.add_time('%s.parse'%label, parse_time, num_run, parse_cpu)
     return results
     
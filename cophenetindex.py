@@ -0,0 +1,178 @@
+import numpy as _np
+
+"""
+Lowest common ancestor (LCA) queries over a SciPy linkage matrix. The Euler
+tour of the tree and a sparse table over the depths along it answer the LCA of
+any two leaves in O(1), so cophenetic distances between arbitrary pairs of the
+original observations can be looked up without `squareform(cophenet(links))`,
+i.e. without building a dense N x N matrix.
+"""
+
+class CophenetIndex(object):
+    """
+    LCA index over the hierarchical clustering given by `links`.
+
+    Parameters
+    ----------
+    links : ndarray
+        A SciPy linkage matrix with N-1 rows for N observations
+
+    Attributes
+    ----------
+    heights : ndarray
+        The merge height of each of the 2N-1 nodes, 0 for the observations
+    depth : ndarray
+        The depth of each node, 0 for the root
+
+    Example
+    -------
+    index = CophenetIndex(np.loadtxt(config['processed']['human']['linkage']))
+    index.cophenet([0, 5], [10, 20])
+    index.max_distance(term_idrs)
+    """
+
+    def __init__(self, links):
+        links = _np.asarray(links)
+        self.n = n = len(links) + 1
+        num_nodes = 2*n - 1
+        left = links[:, 0].astype(_np.intp).tolist()
+        right = links[:, 1].astype(_np.intp).tolist()
+        self.heights = _np.concatenate([_np.zeros(n), links[:, 2]])
+
+        # Iterative Euler tour: a node is written out when it is first visited
+        # and again after each of its children
+        euler = _np.zeros(2*num_nodes - 1, dtype=_np.intp)
+        first = _np.zeros(num_nodes, dtype=_np.intp)
+        depth = [0]*num_nodes
+        visited_children = [0]*num_nodes
+        root = num_nodes - 1
+        stack = [root]
+        pos = 0
+        while stack:
+            node = stack[-1]
+            visits = visited_children[node]
+            if visits == 0:
+                first[node] = pos
+            euler[pos] = node
+            pos += 1
+            if node < n or visits == 2:
+                stack.pop()
+                continue
+            child = left[node - n] if visits == 0 else right[node - n]
+            visited_children[node] = visits + 1
+            depth[child] = depth[node] + 1
+            stack.append(child)
+
+        self.depth = _np.array(depth, dtype=_np.intp)
+        self.first = first
+        self.euler = euler
+
+        # table[k][i] is the shallowest node in euler[i:i+2**k]
+        self.table = [euler]
+        span = 1
+        while 2*span <= len(euler):
+            prev = self.table[-1]
+            a, b = prev[:len(prev) - span], prev[span:]
+            self.table.append(_np.where(self.depth[a] <= self.depth[b], a, b))
+            span *= 2
+
+    def lca(self, i, j):
+        """
+        Returns the LCA node(s) of the node(s) `i` and `j`. Accepts scalars or
+        arrays of node ids; the original observations are nodes 0 to N-1.
+        """
+        first_i, first_j = self.first[i], self.first[j]
+        lo = _np.minimum(first_i, first_j)
+        hi = _np.maximum(first_i, first_j)
+        # floor(log2(length)), exact for integers
+        k = _np.frexp(hi - lo + 1)[1] - 1
+        # Look up each level separately, the table levels differ in length
+        k = _np.atleast_1d(k)
+        lo, hi = _np.atleast_1d(lo), _np.atleast_1d(hi)
+        out = _np.zeros(len(k), dtype=_np.intp)
+        for level in _np.unique(k):
+            sel = k == level
+            a = self.table[level][lo[sel]]
+            b = self.table[level][hi[sel] - (1 << level) + 1]
+            out[sel] = _np.where(self.depth[a] <= self.depth[b], a, b)
+        return out if _np.ndim(i) > 0 or _np.ndim(j) > 0 else out[0]
+
+    def cophenet(self, i, j):
+        """
+        Returns the cophenetic distance(s) between the observation(s) `i` and
+        `j`, the same values as `squareform(cophenet(links))[i, j]`.
+        """
+        return self.heights[self.lca(i, j)]
+
+    def distances(self, idxs):
+        """
+        Returns the condensed cophenetic distance vector between the given
+        observations, in the order of `pdist` or `itertools.combinations`.
+        """
+        idxs = _np.asarray(idxs, dtype=_np.intp)
+        i, j = _np.triu_indices(len(idxs), 1)
+        return self.cophenet(idxs[i], idxs[j])
+
+    def _adjacent_lcas(self, idxs):
+        """
+        Returns the LCAs of consecutive observations when ordered by the Euler
+        tour. The LCA of any pair among `idxs` is the shallowest of these
+        between the two.
+        """
+        idxs = _np.asarray(idxs, dtype=_np.intp)
+        ordered = idxs[_np.argsort(self.first[idxs], kind='mergesort')]
+        return self.lca(ordered[:-1], ordered[1:])
+
+    def group_lca(self, idxs):
+        """
+        Returns the LCA node of all of the given observations
+        """
+        idxs = _np.asarray(idxs, dtype=_np.intp)
+        firsts = self.first[idxs]
+        return self.lca(idxs[firsts.argmin()], idxs[firsts.argmax()])
+
+    def max_distance(self, idxs):
+        """
+        Returns the maximum cophenetic distance between any two of the given
+        observations.
+        """
+        if len(idxs) < 2:
+            return 0.0
+        return self.heights[self._adjacent_lcas(idxs)].max()
+
+    def mean_distance(self, idxs):
+        """
+        Returns the mean cophenetic distance over all pairs of the given
+        observations, in O(k log k) for k observations.
+        """
+        k = len(idxs)
+        if k < 2:
+            return 0.0
+        nodes = self._adjacent_lcas(idxs)
+        depths = self.depth[nodes].tolist()
+        heights = self.heights[nodes].tolist()
+        m = len(nodes)
+
+        # Every pair (a, b) of the ordered observations corresponds to the
+        # range a..b-1 of adjacent LCAs, whose shallowest node is the pair's
+        # LCA. Count the ranges in which each adjacent LCA is the (leftmost)
+        # shallowest one with monotonic stacks.
+        prev_le = [-1]*m
+        stack = []
+        for t in range(m):
+            while stack and depths[stack[-1]] > depths[t]:
+                stack.pop()
+            prev_le[t] = stack[-1] if stack else -1
+            stack.append(t)
+        next_lt = [m]*m
+        stack = []
+        for t in range(m - 1, -1, -1):
+            while stack and depths[stack[-1]] >= depths[t]:
+                stack.pop()
+            next_lt[t] = stack[-1] if stack else m
+            stack.append(t)
+
+        total = 0.0
+        for t in range(m):
+            total += heights[t] * (t - prev_le[t]) * (next_lt[t] - t)
+        return total / (k*(k - 1)/2.)
@@ -0,0 +1,217 @@
+from collections import Counter as _counter
+import numpy as _np
+from numpy.lib.stride_tricks import as_strided as _ast
+
+"""
+The compute core of the helper functions: sequence composition, region and
+HMM scoring functions that only need NumPy. Importing this module is cheap, so
+it should be preferred over `mischelperfuncs` and `hmmhelperfuncs` in worker
+processes and scripts. The functions are re-exported by those modules.
+"""
+
+_aas = ['A', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'K', 'L',
+        'M', 'N', 'P', 'Q', 'R', 'S', 'T', 'V', 'W', 'Y']
+
+# Maps the ASCII code of a residue to its index in `_aas`, everything else to 20
+_aa_lookup = _np.full(256, len(_aas), dtype=_np.uint8)
+for _i, _aa in enumerate(_aas):
+    _aa_lookup[ord(_aa)] = _i
+
+
+def calc_disordered_regions(limits, seq):
+    """
+    Returns the sequence of disordered regions given a string of
+    starts and ends of the regions and the sequence.
+
+    Example
+    -------
+    limits = 1_5;8_10
+    seq = AHSEDQNAAANTH...
+
+    This will return `AHSED_AAA`
+    """
+    seq = seq.replace(' ', '')
+
+    regions = [tuple(region.split('_')) for region
+               in limits.split(';')]
+
+    return '_'.join([seq[int(i)-1:int(j)] for i,j in regions])
+
+def get_freqs(seq, pseudocount=0, verbose=True):
+    """
+    Determines the frequencies of amino acids in a string representation
+    of a sequence.
+
+    Parameters
+    ----------
+    seq : str
+        A string of representation of a protein sequence
+    pseudocount : float, default 0
+        Add a pseudocount to all emission values. When calculating emission
+        values for HMMs trained on limited data 0.01, i.e.
+        1 count per 100 observations, is good default.
+    verbose : bool, default True
+        Print removed values and final counts (for pseudocounts)
+
+    Returns
+    -------
+    dict
+        A dictionary of the amino acids mapped to their frequencies
+
+    See Also
+    --------
+    get_normed_freqs : calculate normalized frequencies from a list of seqs
+
+    """
+    counts = _counter(seq)
+    for aa in list(counts.keys()):
+        if aa not in _aas:
+            removed = counts.pop(aa, -1)
+            if verbose: print('Extraneous char %s occurred %s times; removed.'%(aa,
+                  removed))
+    aa_count = float(sum(counts.values()))
+    freqs = {}
+    for aa in _aas:
+        freqs[aa] = counts[aa] + pseudocount * aa_count
+    final_counts = float(sum(freqs.values()))
+    for aa in _aas:
+        freqs[aa] /= final_counts
+    if verbose: print(final_counts)
+    return freqs
+
+def get_normed_freqs(seqs, pseudocount=0.01):
+    """
+    Determine the frequencies of amino acids in a given list of sequences. The
+    frequencies will be calculated per-sequence and then averaged together so
+    all sequences have an equal contribution to the final frequencies.
+
+    Parameters
+    ----------
+    seqs : list of strings
+        A list of sequences in string form
+    pseudocount : float, default 0.01
+        Add a pseudocount for missing emission values. Defaults to 0.01, i.e.
+        1 count per 100 observations. Necessary if training a HMM on a limited
+        number of sequences.
+
+    Returns
+    -------
+    dict
+        A dictionary of the amino acids mapped to their frequencies
+
+    """
+    seq_counts = [get_freqs(seq, pseudocount) for seq in seqs]
+    num_seqs = float(len(seq_counts))
+
+    normed_freqs = _counter()
+    for aa in _aas:
+        for seq_count in seq_counts:
+            normed_freqs[aa] += seq_count[aa]
+        normed_freqs[aa] /= num_seqs
+    return normed_freqs
+
+def get_aas():
+    """
+    Returns a list of the one-letter amino acid codes
+
+    """
+    return _aas
+
+def encode_seq(seq):
+    """
+    Returns the index of every residue of `seq` in `get_aas` as a `uint8`
+    array. Characters that are not one of the 20 amino acids (spaces, X, U,
+    etc.) are encoded as 20.
+    """
+    return _aa_lookup[_np.frombuffer(seq.encode('ascii'), dtype=_np.uint8)]
+
+def get_percent_enrichments(new, old):
+    """
+    Calculate the change in frequencies of amino acids between two groups as
+    their percent enrichment in the `new` group as compared to the `old` group.
+
+    Parameters
+    ----------
+    new : dict
+        A dictionary of amino acid frequencies for a region of interest
+    old : dict
+        A dictionary of amino acid frequencies to compare against.
+
+    Returns
+    -------
+    dict
+        A dictionary of the amino acids mapped to their percent enrichment in
+        `new` versus `old`
+
+    See Also
+    --------
+    get_fold_enrichments : calculate fold enrichment between two groups
+
+    """
+    return {aa:new[aa]/old[aa]*100 for aa in _aas}
+
+def get_fold_enrichments(new, old):
+    """
+    Calculate amino acid fold enrichment between two groups. Enriched and
+    depleted values are normalized around 1 which makes comparisons between them
+    more straightforward.
+
+    Parameters
+    ----------
+    new : dict
+        A dictionary of amino acid frequencies for a region of interest
+    old : dict
+        A dictionary of amino acid frequencies to compare against.
+
+    Returns
+    -------
+    dict
+        A dictionary of the amino acids mapped to their fold enrichment in
+        `new` versus `old`. Values are centered around 1.
+
+    """
+    return {aa:new[aa]/old[aa] if new[aa] > old[aa] else -1*old[aa]/new[aa] for aa in _aas}
+
+def get_regions(pred, min_length):
+    """
+    Returns the 0-based, inclusive (start, end) tuples of the runs of True
+    values in the boolean array `pred` that are at least `min_length` long.
+    """
+    starts = _np.nonzero(pred & ~_np.roll(pred, 1))[0]
+    ends = _np.nonzero(pred & ~_np.roll(pred, -1))[0]
+    return [(i, j) for i, j in zip(starts, ends) if j+1 >= i + min_length]
+
+def get_viterbi_regions(model, seq, label, min_length):
+    """
+    Returns the regions (see `get_regions`) where the viterbi path of the HMM
+    `model` for `seq` is in the state named `label`.
+    """
+    viterbi_pred = _np.array([state[1].name
+                             for state in model.viterbi(seq)[1][1:]]) == label
+    return get_regions(viterbi_pred, min_length)
+
+def get_posteriors(model, seq):
+    """
+    Returns the posterior state probabilities of the HMM `model` for `seq` as
+    an array of shape (len(seq), number of states), and a dictionary mapping
+    the state names to their columns.
+    """
+    indices = {state.name : i for i,state in enumerate(model.states)}
+    ems = _np.exp(model.forward_backward(list(seq))[1])
+    return ems/_np.sum(ems, axis=1)[:, _np.newaxis], indices
+
+def get_region_score(probs, regions, window):
+    """
+    Returns the maximum sum of the posterior probabilities `probs` of a single
+    state over `window` consecutive positions ending within one of the given
+    regions, or 0 if there are no regions. A perfect match scores `window`.
+    """
+    padding = _np.zeros(window - 1)
+    padded_out = _np.concatenate([padding,probs])
+    strided = _ast(padded_out,shape = (len(padded_out) + 1 - window, window),
+                  strides = padded_out.strides * 2)
+    sums = strided.sum(1)
+    scores = [0]
+    for i,j in regions:
+        scores.append(sums[i:j+1].max())
+    return max(scores)
@@ -1,13 +1,14 @@
-import pandas as _pd, numpy as _np, seaborn as _sns, matplotlib.pyplot as _plt
-from numpy.lib.stride_tricks import as_strided as _ast
-import mischelperfuncs as _mhf
-from matplotlib.patches import Rectangle as _rect
+import numpy as _np
+import corehelperfuncs as _chf
+from corehelperfuncs import get_regions, get_viterbi_regions, get_posteriors, get_region_score
 
 """
-Miscellaneous functions for running and analyzing Hidden Markov Models.
+Miscellaneous functions for running and analyzing Hidden Markov Models. The
+scoring functions live in `corehelperfuncs`; seaborn and matplotlib are only
+imported once something is plotted.
 """
 
-_aas = _mhf.get_aas()
+_aas = _chf.get_aas()
 
 def run_HMM_viterbi_map(model, proteome, window1, window2, label):
     """
@@ -20,37 +21,25 @@ def run_HMM_viterbi_map(model, proteome, window1, window2, label):
     """
     similarity = []
 
-    indices = {state.name : i for i,state in enumerate(model.states)}
-
     for index, row in proteome.iterrows():
         seq = [char for char in row['SEQ'] if char in _aas]
 
-        viterbi_path = model.viterbi(seq)[1]
-
-        viterbi_pred = _np.array([state[1].name 
-                                 for state in viterbi_path[1:]]) == label
-        starts = _np.nonzero(viterbi_pred & ~_np.roll(viterbi_pred, 1))[0]
-        ends = _np.nonzero(viterbi_pred & ~_np.roll(viterbi_pred, -1))[0]
-        sgtr_regions = [(i, j) for i, j in zip(starts, ends) if j+1 >= i + window1]
+        sgtr_regions = get_viterbi_regions(model, seq, label, window1)
 
-        ems = _np.exp(model.forward_backward(list(seq))[1])
-        probs = ems/_np.sum(ems, axis=1)[:, _np.newaxis]
-        out = probs[:, indices[label]]
-        padding = _np.zeros(window2 - 1)
-        padded_out = _np.concatenate([padding,out])
-        strided = _ast(padded_out,shape = (len(padded_out) + 1 - window2, window2),
-                      strides = padded_out.strides * 2)
-        scores = [0]
-        for i,j in sgtr_regions:
-            scores.append(strided.sum(1)[i:j+1].max())
-        similarity.append(max(scores))
+        probs, indices = get_posteriors(model, seq)
+        similarity.append(get_region_score(probs[:, indices[label]], sgtr_regions, window2))
 
     return similarity
 
 def plot_HMM(model, proteome, window1, window2, label, background_label, uniprot_id, regions=[], name="", mutations=[], seq=""):
     """
-    
+    Plots the posterior probabilities of the states of a HMM along a protein,
+    together with the viterbi and MAP regions of the state `label` and the
+    given annotated `regions`.
     """
+    import seaborn as _sns, matplotlib.pyplot as _plt
+    from matplotlib.patches import Rectangle as _rect
+
     if len(seq) == 0:
         seq = [char for char in proteome.loc[uniprot_id, 'SEQ'] if char in _aas]
     else:
@@ -62,36 +51,13 @@ def plot_HMM(model, proteome, window1, window2, label, background_label, uniprot
         print("%s --- %s ---> %s"%(seq[pos-1], pos, aa))
         seq[pos-1] = aa
         
-    indices = {state.name : i for i,state in enumerate(model.states)}
-    
-    # TODO: Duplicate functionality, encapsulate in separate functions
     # Calculate viterbi regions
-    viterbi_pred = _np.array([state[1].name for state in model.viterbi(seq)[1][1:]]) == label
-    starts = _np.nonzero(viterbi_pred & ~_np.roll(viterbi_pred, 1))[0]
-    ends = _np.nonzero(viterbi_pred & ~_np.roll(viterbi_pred, -1))[0]
-    vitb_regions = [(i, j) for i, j in zip(starts, ends) if j+1 >= i + window1]
-    
-    # Calculate MAP regions
-    map_pred = _np.array([state[1].name for state in 
-                         model.maximum_a_posteriori(seq)[1][1:-1]]) == label
+    vitb_regions = get_viterbi_regions(model, seq, label, window1)
     
-    # Calculate posterior probabilities
-    ems = _np.exp(model.forward_backward(list(seq))[1])
-    probs = ems/_np.sum(ems, axis=1)[:, _np.newaxis]
+    # Calculate posterior probabilities and the MAP regions
+    probs, indices = get_posteriors(model, seq)
     out = probs[:, indices[label]]
-    padding = _np.zeros(window2 - 1)
-    padded_out = _np.concatenate([padding,out])
-    strided = _ast(padded_out,shape = (len(padded_out) + 1 - window2, window2),
-                  strides = padded_out.strides * 2)
-    
-    map_pred = out.T >= 0.5
-    starts = _np.nonzero(map_pred & ~_np.roll(map_pred, 1))[0]
-    ends = _np.nonzero(map_pred & ~_np.roll(map_pred, -1))[0]
-    map_regions = [(i, j) for i, j in zip(starts, ends) if j+1 >= i + 5]
-    
-    scores = [0]
-    for i,j in vitb_regions:
-        scores.append(strided.sum(1)[i:j+1].max())
+    map_regions = get_regions(out >= 0.5, 5)
 
     colors = _sns.color_palette('deep', n_colors=6, desat=0.5)
     fig = _plt.figure(figsize=(14,6));
@@ -0,0 +1,213 @@
+import multiprocessing as _mp
+import numpy as _np
+import corehelperfuncs as _chf
+
+"""
+Baum-Welch training of discrete-emission Hidden Markov Models, such as the
+stress granule and Rotavirus NSP5 models, on batches of encoded sequences. The
+forward-backward expectations are vectorized across the sequences of a batch
+and the batches can be spread over several processes. Only NumPy is needed,
+so worker processes start quickly.
+"""
+
+_aas = _chf.get_aas()
+
+
+def encode_seqs(seqs):
+    """
+    Encodes sequences as arrays of amino acid indices (in the order of
+    `get_aas`). Residues that are not one of the 20 amino acids are dropped,
+    like the notebooks do before running a model.
+    """
+    encoded = []
+    for seq in seqs:
+        codes = _chf.encode_seq(seq)
+        encoded.append(codes[codes < len(_aas)].astype(_np.intp))
+    return encoded
+
+def _make_batches(encoded, batch_size):
+    """
+    Groups the encoded sequences into batches of similar lengths. Returns a
+    list of (observations, lengths) with the observations padded to the
+    longest sequence of the batch.
+    """
+    order = _np.argsort([len(seq) for seq in encoded], kind='mergesort')
+    batches = []
+    for i in range(0, len(order), batch_size):
+        seqs = [encoded[j] for j in order[i:i+batch_size] if len(encoded[j]) > 0]
+        if len(seqs) == 0:
+            continue
+        lengths = _np.array([len(seq) for seq in seqs])
+        obs = _np.zeros((len(seqs), lengths.max()), dtype=_np.intp)
+        for row, seq in enumerate(seqs):
+            obs[row, :len(seq)] = seq
+        batches.append((obs, lengths))
+    return batches
+
+def _batch_expectations(args):
+    """
+    Runs the scaled forward-backward algorithm on a batch of sequences at
+    once and returns the expected start, transition and emission counts and
+    the total log-likelihood of the batch.
+    """
+    (obs, lengths), starts, transitions, emissions = args
+    num_seqs, max_len = obs.shape
+    num_states, num_symbols = emissions.shape
+    rows = _np.arange(num_seqs)
+    # Emission probabilities of each observation, (sequences, positions, states)
+    probs = emissions.T[obs]
+    valid = _np.arange(max_len)[None, :] < lengths[:, None]
+
+    # Forward pass, alpha is normalized at every position. Positions past the
+    # end of a sequence keep its last alpha and a scale of 1.
+    alpha = _np.zeros((num_seqs, max_len, num_states))
+    scale = _np.ones((num_seqs, max_len))
+    a = starts[None, :] * probs[:, 0]
+    scale[:, 0] = a.sum(1)
+    alpha[:, 0] = a/scale[:, 0, None]
+    for t in range(1, max_len):
+        a = alpha[:, t-1].dot(transitions) * probs[:, t]
+        s = _np.where(valid[:, t], a.sum(1), 1.0)
+        alpha[:, t] = _np.where(valid[:, t, None], a/s[:, None], alpha[:, t-1])
+        scale[:, t] = s
+
+    # Backward pass with the same scaling
+    beta = _np.ones((num_seqs, max_len, num_states))
+    xi = _np.zeros((num_states, num_states))
+    for t in range(max_len - 2, -1, -1):
+        step = valid[:, t+1]
+        weighted = probs[:, t+1] * beta[:, t+1] / scale[:, t+1, None]
+        beta[:, t] = _np.where(step[:, None], weighted.dot(transitions.T), 1.0)
+        # Expected transitions from t to t+1, summed over the batch
+        xi += _np.einsum('bi,ij,bj->ij', alpha[step, t], transitions, weighted[step])
+
+    gamma = alpha * beta * valid[:, :, None]
+    emission_counts = _np.zeros((num_states, num_symbols))
+    for symbol in range(num_symbols):
+        emission_counts[:, symbol] = gamma[obs == symbol].sum(0)
+
+    log_likelihood = _np.log(scale).sum()
+    return gamma[rows, 0].sum(0), xi, emission_counts, log_likelihood
+
+def baum_welch(seqs, emissions, transitions, starts, fixed_emissions=(), fit_transitions=True,
+               pseudocount=0.01, max_iter=100, tol=1e-3, batch_size=64, processes=1, verbose=True):
+    """
+    Fits the emission and transition probabilities of a discrete-emission HMM
+    to the given sequences with the Baum-Welch algorithm.
+
+    Parameters
+    ----------
+    seqs : list of str
+        The training sequences, e.g. curated stress granule targeting regions
+    emissions : list of dict
+        The initial emission frequencies of each state, as returned by
+        `get_freqs` or `get_normed_freqs`
+    transitions : array-like
+        The initial state transition probabilities, rows sum to 1
+    starts : array-like
+        The initial start probabilities of the states
+    fixed_emissions : list of int, default ()
+        States whose emissions are not refitted, e.g. the background state
+    fit_transitions : bool, default True
+        Whether to refit the transition and start probabilities. States that
+        are never visited keep their initial transitions and emissions.
+    pseudocount : float, default 0.01
+        Pseudocount added to the expected emission counts of each state in the
+        same way as `get_freqs`, i.e. `pseudocount` times the state's total
+        expected count is added to every amino acid.
+    max_iter : int, default 100
+        Maximum number of iterations
+    tol : float, default 1e-3
+        Stop once the log-likelihood improves by less than this
+    batch_size : int, default 64
+        Number of sequences whose expectations are computed together
+    processes : int, default 1
+        Number of worker processes the batches are spread over
+    verbose : bool, default True
+        Print the log-likelihood of each iteration
+
+    Returns
+    -------
+    emissions : list of dict
+        The fitted emission frequencies of each state
+    transitions : ndarray
+        The fitted transition probabilities
+    starts : ndarray
+        The fitted start probabilities
+    log_likelihoods : list of float
+        The log-likelihood of the training sequences before each iteration
+
+    See Also
+    --------
+    to_yahmm : build a yahmm model from the fitted parameters
+
+    """
+    emission_probs = _np.array([[freqs[aa] for aa in _aas] for freqs in emissions], dtype=float)
+    transitions = _np.array(transitions, dtype=float)
+    starts = _np.array(starts, dtype=float)
+    fit_emissions = _np.ones(len(emission_probs), dtype=bool)
+    fit_emissions[list(fixed_emissions)] = False
+
+    batches = _make_batches(encode_seqs(seqs), batch_size)
+    pool = _mp.Pool(processes) if processes > 1 else None
+    log_likelihoods = []
+    try:
+        for iteration in range(max_iter):
+            jobs = [(batch, starts, transitions, emission_probs) for batch in batches]
+            results = pool.map(_batch_expectations, jobs) if pool is not None \
+                else [_batch_expectations(job) for job in jobs]
+
+            start_counts = sum(result[0] for result in results)
+            transition_counts = sum(result[1] for result in results)
+            emission_counts = sum(result[2] for result in results)
+            log_likelihood = sum(result[3] for result in results)
+            if not _np.isfinite(log_likelihood):
+                raise RuntimeError("The log-likelihood of iteration %s is %s, some sequences are "
+                                   "impossible under the current model."%(iteration, log_likelihood))
+            log_likelihoods.append(log_likelihood)
+            if verbose: print('Iteration %s: log-likelihood %.4f'%(iteration, log_likelihood))
+
+            # Same pseudocounts as get_freqs. States without any expected
+            # counts keep their previous probabilities.
+            emission_counts += pseudocount * emission_counts.sum(1)[:, None]
+            emission_totals = emission_counts.sum(1)
+            update = fit_emissions & (emission_totals > 0)
+            emission_probs[update] = emission_counts[update]/emission_totals[update, None]
+            if fit_transitions:
+                transition_totals = transition_counts.sum(1)
+                update = transition_totals > 0
+                transitions[update] = transition_counts[update]/transition_totals[update, None]
+                if start_counts.sum() > 0:
+                    starts = start_counts/start_counts.sum()
+
+            if iteration > 0 and log_likelihood - log_likelihoods[-2] < tol:
+                break
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    emissions = [dict(zip(_aas, probs)) for probs in emission_probs]
+    return emissions, transitions, starts, log_likelihoods
+
+def to_yahmm(name, state_names, emissions, transitions, starts):
+    """
+    Builds and bakes a yahmm model from the given parameters, e.g. those
+    returned by `baum_welch`. Transitions of probability 0 are left out.
+    """
+    import yahmm as _hmm
+
+    model = _hmm.Model(name)
+    states = [_hmm.State(_hmm.DiscreteDistribution(dict(freqs)), name=state_name)
+              for state_name, freqs in zip(state_names, emissions)]
+    for state in states:
+        model.add_state(state)
+    for state, prob in zip(states, starts):
+        if prob > 0:
+            model.add_transition(model.start, state, prob)
+    for i, from_state in enumerate(states):
+        for j, to_state in enumerate(states):
+            if transitions[i][j] > 0:
+                model.add_transition(from_state, to_state, transitions[i][j])
+    model.bake(verbose=True)
+    return model
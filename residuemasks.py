@@ -0,0 +1,247 @@
+import re as _re, ast as _ast
+import numpy as _np, pandas as _pd
+import corehelperfuncs as _chf
+
+"""
+Per-residue annotations (IDRs, LCRs, domains, HMM-called regions, etc.) for a
+whole proteome stored as packed bit arrays. All proteins are concatenated and
+each one starts on a byte boundary, so the packed arrays of different
+annotations can be combined directly with NumPy's bitwise operators and
+counted per protein or per amino acid with a few array operations.
+"""
+
+_aas = _chf.get_aas()
+
+# Number of set bits for every byte value
+_popcount = _np.array([bin(i).count('1') for i in range(256)], dtype=_np.uint8)
+
+_get_lcrs = _re.compile(r'([A-Z]):[^;]*?(\[.*?\]);')
+_get_features = _re.compile(r'(\d+)\s(\d+)\s([^\.;]*)')
+
+
+class ResidueMasks(object):
+    """
+    Packed per-residue annotation layers for a proteome.
+
+    Each layer is a packed `uint8` array (see `numpy.packbits`) in which bit
+    `offsets[p] + k - 1` is set if residue `k` (1-based) of protein `p` is
+    annotated. Layers can be combined with `&`, `|` and `^`; use
+    `mask & ~other & masks.valid` for set differences.
+
+    Parameters
+    ----------
+    proteome : pandas.DataFrame
+        The proteome, one protein per row
+    seq_col : str, default 'SEQ'
+        Column containing the protein sequences
+
+    Example
+    -------
+    masks = ResidueMasks(human_proteome)
+    masks.add_idrs()
+    masks.add_lcrs()
+    masks.overlap(masks['LCR'], masks['IDR30'])
+    masks.residue_overlap(masks['LCR'], masks['IDR30'])
+    """
+
+    def __init__(self, proteome, seq_col='SEQ'):
+        self.proteome = proteome
+        seqs = [_re.sub(r'[^A-Za-z]', '', seq) if _pd.notnull(seq) else ''
+                for seq in proteome[seq_col].values]
+        self.lengths = _np.array([len(seq) for seq in seqs], dtype=_np.intp)
+        # Every protein starts on a byte boundary
+        num_bytes = (self.lengths + 7) // 8
+        self.byte_offsets = _np.concatenate([[0], _np.cumsum(num_bytes)])
+        self.offsets = self.byte_offsets[:-1] * 8
+        self.num_bits = int(self.byte_offsets[-1]) * 8
+
+        # Amino acid index of every bit, 20 for padding and unusual residues
+        self.codes = _np.full(self.num_bits, len(_aas), dtype=_np.uint8)
+        for offset, seq in zip(self.offsets, seqs):
+            self.codes[offset:offset+len(seq)] = _chf.encode_seq(seq)
+
+        # Layer of all residues, i.e. everything but the padding
+        self.valid = self.from_regions(_np.arange(len(seqs)), _np.ones(len(seqs)), self.lengths)
+        self.layers = {}
+
+    def __getitem__(self, name):
+        return self.layers[name]
+
+    def __contains__(self, name):
+        return name in self.layers
+
+    def _rows(self, labels):
+        """
+        Maps proteome index labels to row positions
+        """
+        return self.proteome.index.get_indexer(labels)
+
+    def _positions_to_bits(self, rows, positions):
+        """
+        Converts 1-based residue positions of the proteins in the given rows to
+        bit indices, dropping positions outside of the protein.
+        """
+        rows = _np.asarray(rows, dtype=_np.intp)
+        positions = _np.asarray(positions, dtype=_np.intp)
+        keep = (rows >= 0) & (positions >= 1) & (positions <= self.lengths[rows])
+        return self.offsets[rows[keep]] + positions[keep] - 1
+
+    def from_regions(self, rows, starts, ends):
+        """
+        Returns a packed mask with the given regions set. The regions are given
+        as parallel arrays of row positions and 1-based, inclusive starts and
+        ends; regions are clipped to their protein.
+        """
+        rows = _np.asarray(rows, dtype=_np.intp)
+        starts = _np.asarray(starts, dtype=_np.intp)
+        ends = _np.asarray(ends, dtype=_np.intp)
+        keep = rows >= 0
+        rows, starts, ends = rows[keep], starts[keep], ends[keep]
+        starts = _np.maximum(starts, 1)
+        ends = _np.minimum(ends, self.lengths[rows])
+        keep = starts <= ends
+        rows, starts, ends = rows[keep], starts[keep], ends[keep]
+        # Mark region starts with +1 and the position after their ends with -1
+        diff = _np.zeros(self.num_bits + 1, dtype=_np.int32)
+        _np.add.at(diff, self.offsets[rows] + starts - 1, 1)
+        _np.add.at(diff, self.offsets[rows] + ends, -1)
+        return _np.packbits(_np.cumsum(diff[:-1]) > 0)
+
+    def from_positions(self, rows, positions):
+        """
+        Returns a packed mask with the given residues set. The residues are
+        given as parallel arrays of row positions and 1-based positions.
+        """
+        bits = _np.zeros(self.num_bits, dtype=bool)
+        bits[self._positions_to_bits(rows, positions)] = True
+        return _np.packbits(bits)
+
+    def add_regions(self, name, regions):
+        """
+        Adds a layer from a dictionary (or Series) mapping proteome index
+        labels to lists of 1-based, inclusive (start, end) tuples, e.g. regions
+        called by an HMM.
+        """
+        labels, starts, ends = [], [], []
+        for label, prot_regions in regions.items():
+            for start, end in prot_regions:
+                labels.append(label)
+                starts.append(start)
+                ends.append(end)
+        self.layers[name] = self.from_regions(self._rows(labels), starts, ends)
+        return self.layers[name]
+
+    def add_idrs(self, columns=('IDR1', 'IDR5', 'IDR10', 'IDR30', 'IDR50', 'IDR100')):
+        """
+        Adds a layer for each of the given IDR columns (limits such as
+        `1_50;80_120`), named after the column.
+        """
+        for column in columns:
+            if column not in self.proteome.columns:
+                continue
+            rows, starts, ends = [], [], []
+            for row, limits in enumerate(self.proteome[column].values):
+                if _pd.isnull(limits):
+                    continue
+                for region in limits.split(';'):
+                    start, end = region.split('_')
+                    rows.append(row)
+                    starts.append(int(start))
+                    ends.append(int(end))
+            self.layers[column] = self.from_regions(rows, starts, ends)
+
+    def add_lcrs(self, column='LCRs', prefix='LCR'):
+        """
+        Adds a layer of the residues masked by CAST for every enriched amino
+        acid (e.g. `LCR_S`) and one for all LCRs together (`LCR`). LCRs
+        enriched in other letters (X, B, Z, U) are only part of `LCR`.
+        """
+        rows, positions = {}, {}
+        for row, lcrs in enumerate(self.proteome[column].values):
+            if _pd.isnull(lcrs):
+                continue
+            for aa, lcr_positions in _get_lcrs.findall(lcrs):
+                lcr_positions = _ast.literal_eval(lcr_positions)
+                rows.setdefault(aa, []).extend([row]*len(lcr_positions))
+                positions.setdefault(aa, []).extend(lcr_positions)
+        union = _np.zeros_like(self.valid)
+        for aa in sorted(rows):
+            layer = self.from_positions(rows[aa], positions[aa])
+            if aa in _aas:
+                self.layers['%s_%s'%(prefix, aa)] = layer
+            union |= layer
+        self.layers[prefix] = union
+
+    def add_features(self, column, name=None, pattern=None):
+        """
+        Adds a layer from an Uniprot feature column (e.g. `DOMFT`, `REGION`,
+        `COMPBIAS`). If given, only the features whose description matches
+        the regex `pattern` are included. The layer is named `name` or after
+        the column.
+        """
+        query = _re.compile(pattern) if pattern is not None else None
+        rows, starts, ends = [], [], []
+        for row, features in enumerate(self.proteome[column].values):
+            if _pd.isnull(features):
+                continue
+            for start, end, description in _get_features.findall(features):
+                if query is not None and not query.search(description):
+                    continue
+                rows.append(row)
+                starts.append(int(start))
+                ends.append(int(end))
+        name = name if name is not None else column
+        self.layers[name] = self.from_regions(rows, starts, ends)
+        return self.layers[name]
+
+    def counts(self, mask):
+        """
+        Returns the number of set residues per protein as a Series
+        """
+        cumulative = _np.concatenate([[0], _np.cumsum(_popcount[mask], dtype=_np.int64)])
+        return _pd.Series(cumulative[self.byte_offsets[1:]] - cumulative[self.byte_offsets[:-1]],
+                          index=self.proteome.index)
+
+    def residue_counts(self, mask):
+        """
+        Returns the number of set residues per amino acid as a Series
+        """
+        codes = self.codes[_np.unpackbits(mask).astype(bool)]
+        return _pd.Series(_np.bincount(codes, minlength=len(_aas) + 1)[:len(_aas)], index=_aas)
+
+    def overlap(self, a, b, population='length'):
+        """
+        Returns a DataFrame with, per protein, its length, the sizes of `a`,
+        `b`, their intersection and union, the percentage of `a` overlapping
+        `b`, and the hypergeometric p-value of an overlap at least this large.
+
+        By default the p-value draws `b`'s residues from all residues of the
+        protein (`population='length'`). `population='sizes'` uses the sizes
+        of `a` and `b` added together as the population instead, which is
+        the null model of the per-protein tests in `LCR_IDR_similarity.ipynb`.
+        """
+        from scipy.stats import hypergeom
+
+        out = _pd.DataFrame({'length':self.lengths, 'a':self.counts(a).values,
+                             'b':self.counts(b).values, 'both':self.counts(a & b).values,
+                             'either':self.counts(a | b).values},
+                            index=self.proteome.index,
+                            columns=['length', 'a', 'b', 'both', 'either'])
+        if population == 'length':
+            total = out['length'].values
+        elif population == 'sizes':
+            total = out['a'].values + out['b'].values
+        else:
+            raise ValueError("population must be 'length' or 'sizes', not %r"%(population,))
+        with _np.errstate(divide='ignore', invalid='ignore'):
+            out['percent_overlap'] = out['both']/out['a'].astype(float)*100
+        out['pval'] = hypergeom.sf(out['both'].values - 1, total, out['a'].values, out['b'].values)
+        return out
+
+    def residue_overlap(self, a, b):
+        """
+        Returns, per amino acid, the percentage of the residues set in `a` that
+        are also set in `b`.
+        """
+        with _np.errstate(divide='ignore', invalid='ignore'):
+            return self.residue_counts(a & b)/self.residue_counts(a).astype(float)*100
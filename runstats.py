@@ -0,0 +1,238 @@
+import os as _os, sys as _sys, time as _time, json as _json, math as _math, heapq as _heapq
+from contextlib import contextmanager as _contextmanager
+
+"""
+Timing and throughput instrumentation for long running disorder prediction
+jobs (see `DisorderedAlgoRunner.runDisorderedAnalysis`). Stages are timed for
+both wall and CPU time (including the CPU time of the IUPred/CAST child
+processes), per-sequence latencies are binned into a histogram and the slowest
+sequences are tracked. When instrumentation is turned off the `NullStats`
+stand-in is used, whose methods do nothing.
+"""
+
+def cpu_time():
+    """
+    Returns the CPU time (user + system) used by this process and all of its
+    finished child processes.
+    """
+    t = _os.times()
+    return t[0] + t[1] + t[2] + t[3]
+
+def _format_duration(seconds):
+    """
+    Formats a number of seconds as H:MM:SS
+    """
+    seconds = int(round(seconds))
+    return '%d:%02d:%02d'%(seconds // 3600, (seconds % 3600) // 60, seconds % 60)
+
+
+class RunStats(object):
+    """
+    Collects per-stage timers, per-sequence latencies and progress information
+    for a single run.
+
+    Parameters
+    ----------
+    name : str
+        A name for the run, e.g. the input file
+    report_every : float, default 30
+        Minimum number of seconds between two progress lines
+    num_slowest : int, default 10
+        Number of slowest sequences to keep track of
+    stream : file, default sys.stdout
+        Where progress lines are written to
+
+    Example
+    -------
+    stats = RunStats('human_proteome.csv')
+    with stats.stage('iupred'):
+        ...
+    stats.write('human_proteome_runstats.json')
+    """
+    enabled = True
+
+    def __init__(self, name='', report_every=30.0, num_slowest=10, stream=None):
+        self.name = name
+        self.report_every = report_every
+        self.num_slowest = num_slowest
+        self.stream = stream if stream is not None else _sys.stdout
+        self.stages = {}
+        self.stage_order = []
+        self.latencies = {}
+        self._progress = None
+        self._start_wall = _time.time()
+        self._start_cpu = cpu_time()
+
+    @_contextmanager
+    def stage(self, name):
+        """
+        Context manager that adds the wall and CPU time spent inside of it to
+        the stage `name`. Stages can be entered multiple times and nested.
+        """
+        # Register the stage on entry so nested stages are listed after it
+        if name not in self.stages:
+            self.stages[name] = {'wall':0.0, 'cpu':0.0, 'calls':0}
+            self.stage_order.append(name)
+        wall, cpu = _time.time(), cpu_time()
+        try:
+            yield self
+        finally:
+            entry = self.stages[name]
+            entry['wall'] += _time.time() - wall
+            entry['cpu'] += cpu_time() - cpu
+            entry['calls'] += 1
+
+    def add_time(self, name, wall, calls=1, cpu=0.0):
+        """
+        Adds wall (and optionally CPU) time that was measured elsewhere to the
+        stage `name`. Used for sub-stages too short to time individually with
+        `stage`.
+        """
+        if name not in self.stages:
+            self.stages[name] = {'wall':0.0, 'cpu':0.0, 'calls':0}
+            self.stage_order.append(name)
+        entry = self.stages[name]
+        entry['wall'] += wall
+        entry['cpu'] += cpu
+        entry['calls'] += calls
+
+    def start_progress(self, label, total):
+        """
+        Starts tracking progress of `total` sequences for the given label.
+        Progress lines with the current throughput and ETA are written
+        at most every `report_every` seconds.
+        """
+        now = _time.time()
+        self._progress = {'label':label, 'total':total, 'done':0,
+                          'start':now, 'last_report':now}
+
+    def record(self, label, seconds, seq_name=None, seq_len=None):
+        """
+        Records the latency of a single sequence under the given label and
+        advances the progress counter.
+        """
+        if label not in self.latencies:
+            self.latencies[label] = {'count':0, 'total':0.0, 'residues':0,
+                                     'histogram':{}, 'slowest':[]}
+        entry = self.latencies[label]
+        entry['count'] += 1
+        entry['total'] += seconds
+        if seq_len is not None:
+            entry['residues'] += seq_len
+        # Half-octave bins, labelled by their lower edge in seconds
+        if seconds > 0:
+            bin_edge = 2**(_math.floor(_math.log(seconds, 2)*2)/2.)
+            key = '%.3g'%bin_edge
+            entry['histogram'][key] = entry['histogram'].get(key, 0) + 1
+        # Min-heap, so the fastest of the slowest sequences is dropped first
+        item = (seconds, str(seq_name), seq_len)
+        if len(entry['slowest']) < self.num_slowest:
+            _heapq.heappush(entry['slowest'], item)
+        elif seconds > entry['slowest'][0][0]:
+            _heapq.heapreplace(entry['slowest'], item)
+
+        self.skip(label)
+
+    def skip(self, label):
+        """
+        Advances the progress counter for a sequence that was not run, e.g.
+        because it is missing.
+        """
+        progress = self._progress
+        if progress is not None and progress['label'] == label:
+            progress['done'] += 1
+            now = _time.time()
+            if now - progress['last_report'] >= self.report_every:
+                progress['last_report'] = now
+                self.report_progress()
+
+    def report_progress(self):
+        """
+        Writes a single progress line with the throughput and ETA.
+        """
+        progress = self._progress
+        if progress is None:
+            return
+        elapsed = _time.time() - progress['start']
+        rate = progress['done']/elapsed if elapsed > 0 else 0.0
+        remaining = progress['total'] - progress['done']
+        eta = _format_duration(remaining/rate) if rate > 0 else '?'
+        self.stream.write('  %s: %s/%s sequences (%.1f seq/s, elapsed %s, ETA %s)\n'%(
+            progress['label'], progress['done'], progress['total'], rate,
+            _format_duration(elapsed), eta))
+        self.stream.flush()
+
+    def to_dict(self):
+        """
+        Returns a JSON serializable summary of the run
+        """
+        wall = _time.time() - self._start_wall
+        latencies = {}
+        for label, entry in self.latencies.items():
+            latencies[label] = {
+                'count':entry['count'],
+                'total_seconds':entry['total'],
+                'mean_seconds':entry['total']/entry['count'] if entry['count'] else None,
+                'sequences_per_second':entry['count']/entry['total'] if entry['total'] > 0 else None,
+                'residues':entry['residues'],
+                'histogram':entry['histogram'],
+                'slowest':[{'seconds':s, 'name':n, 'length':l} for s, n, l
+                           in sorted(entry['slowest'], reverse=True)]
+            }
+        return {
+            'name':self.name,
+            'started':_time.strftime('%Y-%m-%d %H:%M:%S', _time.localtime(self._start_wall)),
+            'wall_seconds':wall,
+            'cpu_seconds':cpu_time() - self._start_cpu,
+            'stages':[dict(name=name, **self.stages[name]) for name in self.stage_order],
+            'latencies':latencies
+        }
+
+    def summary(self):
+        """
+        Returns a human readable table of the stage timings
+        """
+        lines = ['%-28s %10s %10s %6s'%('stage', 'wall (s)', 'cpu (s)', 'calls')]
+        for name in self.stage_order:
+            entry = self.stages[name]
+            lines.append('%-28s %10.2f %10.2f %6d'%(name, entry['wall'], entry['cpu'], entry['calls']))
+        return '\n'.join(lines)
+
+    def write(self, filename):
+        """
+        Writes the run report as JSON to the given filename
+        """
+        with open(filename, 'w') as f:
+            _json.dump(self.to_dict(), f, indent=4, sort_keys=True)
+
+
+class NullStats(object):
+    """
+    A stand-in for `RunStats` that records nothing. Used when instrumentation
+    is turned off so the runners don't need to check for it.
+    """
+    enabled = False
+
+    @_contextmanager
+    def stage(self, name):
+        yield self
+
+    def add_time(self, name, wall, calls=1, cpu=0.0):
+        pass
+
+    def start_progress(self, label, total):
+        pass
+
+    def record(self, label, seconds, seq_name=None, seq_len=None):
+        pass
+
+    def skip(self, label):
+        pass
+
+    def report_progress(self):
+        pass
+
+    def write(self, filename):
+        pass
+
+NULL_STATS = NullStats()
@@ -0,0 +1,292 @@
+import re as _re
+import numpy as _np, pandas as _pd
+import corehelperfuncs as _chf
+
+"""
+A compact index over the taxonomic lineages of a proteome. The taxa are stored
+as flat node arrays in DFS preorder and the proteins are reordered so that the
+proteins of every taxon (including those of its descendants) form a contiguous
+span. Per-node IDR/LCR counts and summed amino acid composition vectors are
+precomputed with a single cumulative sum over the protein ordering, so any
+aggregate for a family, genus, etc. is an O(1) lookup instead of a tree walk.
+"""
+
+_aas = _chf.get_aas()
+
+_get_lcr_aas = _re.compile(r'(?:^|;)([A-Z]):')
+
+# Column layout of the per-protein/per-node feature matrix
+_n = len(_aas)
+_PROTEINS, _WITH_IDR, _WITH_LCR, _IDRS, _LCRS = range(5)
+_SEQ_COMP = slice(5, 5 + _n)
+_IDR_COMP = slice(5 + _n, 5 + 2*_n)
+_IDR_FREQS = slice(5 + 2*_n, 5 + 3*_n)
+_LCR_AAS = slice(5 + 3*_n, 5 + 4*_n)
+_NUM_FEATURES = 5 + 4*_n
+
+
+def _composition(seq):
+    """
+    Returns the counts of the 20 amino acids in `seq` as an array ordered as
+    `get_aas`. Other characters (spaces, X, U, etc.) are ignored.
+    """
+    return _np.bincount(_chf.encode_seq(seq), minlength=_n + 1)[:_n]
+
+def _parse_lineage(taxon):
+    """
+    Splits an Uniprot lineage string (species first) into its levels ordered
+    from the root down to the species.
+    """
+    return [level.strip() for level in taxon.split(',')][::-1]
+
+
+class TaxonomyIndex(object):
+    """
+    Taxonomy index of a proteome built from its lineage column.
+
+    Parameters
+    ----------
+    proteome : pandas.DataFrame
+        The proteome, one protein per row, e.g. the "polyprots" viral dataset
+    taxon_col : str, default 'TAXON'
+        Column containing the lineage, species first and separated by commas
+    seq_col : str, default 'SEQ'
+        Column containing the protein sequences
+    idr_col : str, default 'IDR30'
+        Column containing the IDR limits (e.g. `1_50;80_120`) to aggregate
+    lcr_col : str, default 'LCRs'
+        Column containing the CAST output as generated by
+        `DisorderedAlgoRunner.runDisorderedAnalysis`
+    root_name : str, default 'root'
+        Name of the artificial root node joining all lineages
+
+    Attributes
+    ----------
+    names : list of str
+        Node names, indexed by node id. Node ids are in DFS preorder.
+    parent : ndarray
+        Parent node id of each node, the root is its own parent
+    depth : ndarray
+        Depth of each node, the root has depth 0
+    subtree_end : ndarray
+        Node `n`'s descendants have the ids `n+1` to `subtree_end[n]-1`
+    order : ndarray
+        Positions (in `proteome`) of the proteins sorted by taxon
+    span_start, span_end : ndarray
+        The proteins of the subtree rooted at node `n` are
+        `order[span_start[n]:span_end[n]]`
+
+    Example
+    -------
+    index = TaxonomyIndex(viral_proteome)
+    index.counts('Picornaviridae')
+    index.fold_enrichments('Picornaviridae', human_idr_freqs)
+    """
+
+    def __init__(self, proteome, taxon_col='TAXON', seq_col='SEQ', idr_col='IDR30',
+                 lcr_col='LCRs', root_name='root'):
+        self.proteome_index = proteome.index
+
+        # Build the lineage trie with temporary ids in order of appearance
+        names = [root_name]
+        parents = [0]
+        children = [[]]
+        lookup = {}
+        prot_nodes = _np.zeros(len(proteome), dtype=_np.intp)
+        for i, taxon in enumerate(proteome[taxon_col].values):
+            node = 0
+            if _pd.notnull(taxon):
+                for level in _parse_lineage(taxon):
+                    key = (node, level)
+                    if key not in lookup:
+                        lookup[key] = len(names)
+                        names.append(level)
+                        parents.append(node)
+                        children.append([])
+                        children[node].append(lookup[key])
+                    node = lookup[key]
+            prot_nodes[i] = node
+
+        # Renumber the nodes in DFS preorder so that every subtree is a
+        # contiguous range of node ids
+        num_nodes = len(names)
+        preorder = _np.zeros(num_nodes, dtype=_np.intp)
+        new_ids = _np.zeros(num_nodes, dtype=_np.intp)
+        stack = [0]
+        pos = 0
+        while stack:
+            node = stack.pop()
+            preorder[pos] = node
+            new_ids[node] = pos
+            pos += 1
+            stack.extend(reversed(children[node]))
+
+        self.names = [names[node] for node in preorder]
+        self.parent = new_ids[_np.array(parents, dtype=_np.intp)[preorder]]
+        self.depth = _np.zeros(num_nodes, dtype=_np.intp)
+        for node in range(1, num_nodes):
+            # Parents always precede their children in preorder
+            self.depth[node] = self.depth[self.parent[node]] + 1
+        self.subtree_end = _np.arange(1, num_nodes + 1)
+        for node in range(num_nodes - 1, 0, -1):
+            parent = self.parent[node]
+            self.subtree_end[parent] = max(self.subtree_end[parent], self.subtree_end[node])
+
+        self._name_to_nodes = {}
+        for node, name in enumerate(self.names):
+            self._name_to_nodes.setdefault(name, []).append(node)
+
+        # Order the proteins by the preorder id of their taxon. Since subtrees
+        # are contiguous ranges of ids, so are the proteins they contain.
+        self.protein_nodes = new_ids[prot_nodes]
+        self.order = _np.argsort(self.protein_nodes, kind='mergesort')
+        sorted_nodes = self.protein_nodes[self.order]
+        node_ids = _np.arange(num_nodes)
+        self.span_start = _np.searchsorted(sorted_nodes, node_ids, side='left')
+        self.span_end = _np.searchsorted(sorted_nodes, self.subtree_end, side='left')
+
+        # Per-protein features in taxon order, aggregated for all nodes at once
+        features = _np.zeros((len(proteome) + 1, _NUM_FEATURES))
+        seqs = proteome[seq_col].values
+        idrs = proteome[idr_col].values if idr_col in proteome.columns else [_np.nan]*len(proteome)
+        lcrs = proteome[lcr_col].values if lcr_col in proteome.columns else [_np.nan]*len(proteome)
+        for row, i in enumerate(self.order, 1):
+            feats = features[row]
+            feats[_PROTEINS] = 1
+            seq = seqs[i]
+            if _pd.isnull(seq):
+                continue
+            seq = seq.replace(' ', '')
+            feats[_SEQ_COMP] = _composition(seq)
+            if _pd.notnull(idrs[i]):
+                feats[_WITH_IDR] = 1
+                for idr in _chf.calc_disordered_regions(idrs[i], seq).split('_'):
+                    counts = _composition(idr)
+                    total = counts.sum()
+                    if total == 0:
+                        continue
+                    feats[_IDRS] += 1
+                    feats[_IDR_COMP] += counts
+                    feats[_IDR_FREQS] += counts/float(total)
+            if _pd.notnull(lcrs[i]):
+                lcr_aas = _get_lcr_aas.findall(lcrs[i])
+                feats[_WITH_LCR] = 1 if len(lcr_aas) > 0 else 0
+                feats[_LCRS] = len(lcr_aas)
+                for aa in lcr_aas:
+                    # LCRs of other letters (X, B, Z, U) only count in the totals
+                    if aa in _aas:
+                        feats[_LCR_AAS][_aas.index(aa)] += 1
+
+        cumulative = _np.cumsum(features, axis=0)
+        self.node_features = cumulative[self.span_end] - cumulative[self.span_start]
+
+    def __len__(self):
+        return len(self.names)
+
+    def node(self, name):
+        """
+        Returns the node id for the given taxon name (or node id). Raises a
+        KeyError if the name is unknown and a ValueError if it is ambiguous.
+        """
+        if isinstance(name, (int, _np.integer)):
+            return int(name)
+        nodes = self._name_to_nodes[name]
+        if len(nodes) > 1:
+            raise ValueError("%s is ambiguous, it occurs in %s lineages. Use the node id instead."%(
+                name, len(nodes)))
+        return nodes[0]
+
+    def children(self, name):
+        """
+        Returns the node ids of the direct children of a node
+        """
+        node = self.node(name)
+        nodes = _np.arange(node + 1, self.subtree_end[node])
+        return nodes[self.parent[nodes] == node]
+
+    def lineage(self, name):
+        """
+        Returns the names of the taxa from the root down to the given node
+        """
+        node = self.node(name)
+        levels = [self.names[node]]
+        while node != 0:
+            node = self.parent[node]
+            levels.append(self.names[node])
+        return levels[::-1]
+
+    def proteins(self, name):
+        """
+        Returns the index labels of all proteins belonging to the taxon
+        """
+        node = self.node(name)
+        return self.proteome_index[self.order[self.span_start[node]:self.span_end[node]]]
+
+    def counts(self, name):
+        """
+        Returns a dictionary with the number of proteins, the number of
+        proteins with IDRs and LCRs, and the total number of IDRs and LCRs
+        belonging to the taxon.
+        """
+        feats = self.node_features[self.node(name)]
+        return {'proteins':int(feats[_PROTEINS]), 'with_idr':int(feats[_WITH_IDR]),
+                'with_lcr':int(feats[_WITH_LCR]), 'idrs':int(feats[_IDRS]),
+                'lcrs':int(feats[_LCRS])}
+
+    def idr_freqs(self, name, normed=True):
+        """
+        Returns the amino acid frequencies of the IDRs belonging to the taxon.
+        If `normed` is true, the frequencies are calculated per IDR and then
+        averaged (see `get_normed_freqs`), otherwise all IDR residues are
+        pooled.
+        """
+        feats = self.node_features[self.node(name)]
+        if normed:
+            freqs = feats[_IDR_FREQS]/feats[_IDRS] if feats[_IDRS] > 0 else feats[_IDR_FREQS]
+        else:
+            total = feats[_IDR_COMP].sum()
+            freqs = feats[_IDR_COMP]/total if total > 0 else feats[_IDR_COMP]
+        return dict(zip(_aas, freqs))
+
+    def proteome_freqs(self, name):
+        """
+        Returns the pooled amino acid frequencies of all proteins belonging to
+        the taxon.
+        """
+        comp = self.node_features[self.node(name), _SEQ_COMP]
+        total = comp.sum()
+        return dict(zip(_aas, comp/total if total > 0 else comp))
+
+    def lcr_counts(self, name):
+        """
+        Returns the number of LCRs enriched in each amino acid belonging to
+        the taxon. LCRs enriched in other letters are not included.
+        """
+        comp = self.node_features[self.node(name), _LCR_AAS]
+        return dict(zip(_aas, comp.astype(int)))
+
+    def fold_enrichments(self, name, reference, normed=True):
+        """
+        Returns the fold enrichment of the taxon's IDR amino acid frequencies
+        compared to `reference`, e.g. the human IDRome frequencies. See
+        `get_fold_enrichments`.
+        """
+        return _chf.get_fold_enrichments(self.idr_freqs(name, normed), reference)
+
+    def summary(self, depth=None):
+        """
+        Returns a DataFrame with the name, depth, parent and the counts of all
+        nodes, optionally restricted to the nodes at the given depth.
+        """
+        feats = self.node_features
+        out = _pd.DataFrame({'name':self.names, 'depth':self.depth, 'parent':self.parent,
+                             'proteins':feats[:, _PROTEINS].astype(int),
+                             'with_idr':feats[:, _WITH_IDR].astype(int),
+                             'with_lcr':feats[:, _WITH_LCR].astype(int),
+                             'idrs':feats[:, _IDRS].astype(int),
+                             'lcrs':feats[:, _LCRS].astype(int)},
+                            columns=['name', 'depth', 'parent', 'proteins', 'with_idr',
+                                     'with_lcr', 'idrs', 'lcrs'])
+        if depth is not None:
+            out = out[out['depth'] == depth]
+        return out